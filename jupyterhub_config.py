@@ -1,4 +1,6 @@
 import os
+import logging
+import docker
 from dockerspawner import DockerSpawner
 from nativeauthenticator import NativeAuthenticator
 
@@ -24,27 +26,52 @@ c.DockerSpawner.network_name = os.environ.get(
 c.DockerSpawner.remove = True
 c.DockerSpawner.debug = True
 
-# Prevent pulling images - use local images only
+# Prevent pulling images at spawn time - the image is made available once at
+# hub start-up below
 c.DockerSpawner.pull_policy = "never"
 
 # Mount shared directories and student work directories directly to host filesystem
-# Get the host path from environment variable (set by docker-compose)
-host_path = os.environ.get("JUPYTERHUB_HOST_PATH", os.getcwd())
+# Get the host path from environment variable (set by docker-compose); fail at
+# start-up if it is missing rather than falling back to the hub's own directory
+host_path = os.environ["JUPYTERHUB_HOST_PATH"]
 
-c.DockerSpawner.volumes = {
+
+def ensure_notebook_image(image):
+    """Make sure the notebook image is available locally, pulling it if needed"""
+    log = logging.getLogger("JupyterHub")
+
+    try:
+        client = docker.from_env()
+        try:
+            client.images.get(image)
+        except docker.errors.ImageNotFound:
+            log.info(f"Notebook image {image} not found locally, pulling it")
+            client.images.pull(image)
+    except Exception as e:
+        log.warning(f"Could not prepare notebook image {image}: {e}")
+
+
+ensure_notebook_image(c.DockerSpawner.image)
+
+
+# Read-only shared mounts use "cached" (host is authoritative) and student work
+# uses "delegated" (container is authoritative) to avoid synchronous file
+# sharing on Docker Desktop; both are ignored by Docker on Linux hosts
+VOLUMES = {
     # f"{host_path}/notebooks": {
     #     "bind": "/home/jovyan/notebooks",
-    #     "mode": "ro",
+    #     "mode": "ro,cached",
     # },
     f"{host_path}/data": {
         "bind": "/home/jovyan/data",
-        "mode": "ro",
+        "mode": "ro,cached",
     },
     f"{host_path}/student_work/{{username}}": {
         "bind": "/home/jovyan/",
-        "mode": "rw",
+        "mode": "rw,delegated",
     },
 }
+c.DockerSpawner.volumes = VOLUMES
 
 # Container settings
 c.DockerSpawner.extra_create_kwargs = {
@@ -100,13 +127,19 @@ c.JupyterHub.cleanup_proxy = True
 # Hub startup
 c.JupyterHub.hub_connect_ip = "jupyterhub"
 
-# Enable spawner debug mode
-c.DockerSpawner.debug = True
-
 # In your jupyterhub_config.py, add these lines:
 c.DockerSpawner.environment = {
-    "JUPYTER_RUNTIME_DIR": "/tmp/jupyter-runtime",
-    "JUPYTER_DATA_DIR": "/tmp/jupyter-data",
+    "JUPYTER_RUNTIME_DIR": "/tmp/jupyter/runtime",
+    "JUPYTER_DATA_DIR": "/tmp/jupyter/data",
+}
+
+# Keep the Jupyter runtime/data directories above in memory rather than writing
+# them through the overlay filesystem; the rest of /tmp stays on disk so source
+# builds are not limited in size or by noexec
+c.DockerSpawner.extra_host_config = {
+    "tmpfs": {
+        "/tmp/jupyter": "size=512m,uid=1000,gid=100,mode=0700",
+    },
 }
 
 
@@ -127,10 +160,28 @@ def pre_spawn_hook(spawner):
     else:
         work_dir = f"/srv/jupyterhub/student_work/{username}"
 
+    work_dir_mode = (
+        stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH
+    )
+
+    # Returning users already have a work directory with the right permissions
+    if platform.system() != "Windows":
+        try:
+            if stat.S_IMODE(os.stat(work_dir).st_mode) == work_dir_mode:
+                spawner.log.info(f"Verified work directory: {work_dir}")
+                return
+        except FileNotFoundError:
+            pass
+
     # Create the student's work directory if it doesn't exist
     try:
-        os.makedirs(work_dir, exist_ok=True)
-        spawner.log.info(f"Created/verified work directory: {work_dir}")
+        os.makedirs(os.path.dirname(work_dir), exist_ok=True)
+        os.mkdir(work_dir)
+        created = True
+        spawner.log.info(f"Created work directory: {work_dir}")
+    except FileExistsError:
+        created = False
+        spawner.log.info(f"Verified work directory: {work_dir}")
     except Exception as e:
         spawner.log.error(f"Failed to create work directory {work_dir}: {e}")
         return
@@ -138,6 +189,10 @@ def pre_spawn_hook(spawner):
     # Set permissions based on platform
     try:
         if platform.system() == "Windows":
+            # The ACL only needs granting once, when the directory is created
+            if not created:
+                return
+
             # For Windows, we can try to use the subprocess module to set permissions
             # using icacls (if more granular control is needed)
             import subprocess
@@ -156,15 +211,13 @@ def pre_spawn_hook(spawner):
                     f"Could not set Windows ACL permissions: {icacls_error}"
                 )
         else:
-            # Unix-style permissions
-            os.chmod(
-                work_dir,
-                stat.S_IRWXU
-                | stat.S_IRGRP
-                | stat.S_IXGRP
-                | stat.S_IROTH
-                | stat.S_IXOTH,
-            )
+            # Unix-style permissions, set on the open directory to avoid a
+            # second path lookup
+            fd = os.open(work_dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fchmod(fd, work_dir_mode)
+            finally:
+                os.close(fd)
             spawner.log.info(f"Set Unix permissions for: {work_dir}")
     except Exception as e:
         spawner.log.warning(f"Could not set permissions on {work_dir}: {e}")
@@ -172,4 +225,5 @@ def pre_spawn_hook(spawner):
 
 
 c.DockerSpawner.pre_spawn_hook = pre_spawn_hook
-c.DockerSpawner.post_start_cmd = f"cp -rn /tmp_notebooks/. /home/jovyan"
+# Example notebooks are copied into the student's home by a start-up hook baked
+# into the notebook image (see Dockerfile.notebook)
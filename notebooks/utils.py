@@ -1,17 +1,19 @@
+import functools
+import math
 import batman
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-from typing import Tuple, Callable, Optional
+from scipy.optimize import least_squares
+from typing import Tuple, Callable, List, Optional
 import warnings
 
 
-def find_nearest_idx(array, value):
+def find_nearest_idx(array, value, is_sorted=False):
     """
     Finds nearest index in array from value provided
 
     Params:
-
+        is_sorted: set to True if a 1-D array is in ascending order (e.g. a
+            time series) to use a binary search instead of a full scan
 
     Returns:
         index
@@ -22,7 +24,17 @@ def find_nearest_idx(array, value):
     """
 
     array = np.asarray(array)
-    if array.ndim == 1:
+    if array.ndim == 1 and np.issubdtype(array.dtype, np.floating):
+        # Match the array precision so float32 data is not promoted to float64
+        value = array.dtype.type(value)
+
+    if is_sorted and array.ndim == 1:
+        idx = int(np.searchsorted(array, value))
+        if idx == len(array) or (
+            idx > 0 and abs(array[idx] - value) >= abs(array[idx - 1] - value)
+        ):
+            idx -= 1
+    elif array.ndim == 1:
         idx = (np.abs(array - value)).argmin()
     else:
         idx = np.sum((np.abs(array - value)), axis=-1).argmin()
@@ -49,11 +61,9 @@ def calculate_next_transit_time(
     float
         Next transit time (BJD)
     """
-    transit_time = reference_time
-    # Find the next transit after start_time
-    while transit_time < start_time:
-        transit_time += period
-    return transit_time
+    # Number of whole periods needed to reach start_time (none if already past)
+    n_periods = max(0, math.ceil((start_time - reference_time) / period))
+    return reference_time + n_periods * period
 
 
 def fit_quadratic_baseline(
@@ -86,6 +96,69 @@ def fit_quadratic_baseline(
     return quadratic_model
 
 
+def _covariance_from_jacobian(jac: np.ndarray, chi2: float, dof: int) -> np.ndarray:
+    """
+    Estimate the parameter covariance matrix from a least-squares Jacobian.
+
+    The covariance is (J^T J)^-1, computed via a pseudo-inverse, scaled by the
+    reduced chi-squared chi2 / dof.
+
+    Parameters:
+    -----------
+    jac : np.ndarray
+        Jacobian of the residuals at the solution
+    chi2 : float
+        Sum of squared residuals at the solution (unscaled, i.e. 2 * cost)
+    dof : int
+        Degrees of freedom (number of data points minus number of parameters)
+
+    Returns:
+    --------
+    np.ndarray
+        Parameter covariance matrix
+    """
+    _, s, VT = np.linalg.svd(jac, full_matrices=False)
+    threshold = np.finfo(float).eps * max(jac.shape) * s[0]
+    s = s[s > threshold]
+    VT = VT[: s.size]
+    return np.dot(VT.T / s**2, VT) * (chi2 / dof)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_transit_model(time_bytes: bytes, dtype: str) -> batman.TransitModel:
+    """
+    Build a batman transit model for a time grid, cached by the grid contents.
+
+    Parameters:
+    -----------
+    time_bytes : bytes
+        Raw bytes of the time array (BJD)
+    dtype : str
+        NumPy dtype string of the time array
+
+    Returns:
+    --------
+    batman.TransitModel
+        Transit model; evaluate it with the caller's own TransitParams
+    """
+    time = np.frombuffer(time_bytes, dtype=dtype)
+
+    # Placeholder values, only used to build the model; light_curve compares
+    # the parameters it is given against its own stored copies
+    params = batman.TransitParams()
+    params.t0 = float(time[0])  # Mid-transit time
+    params.per = 1.0  # Orbital period
+    params.rp = 0.1  # Planet radius / stellar radius
+    params.a = 10.0  # Semi-major axis / stellar radius
+    params.inc = 90.0  # Inclination (degrees)
+    params.ecc = 0.0  # Eccentricity (circular orbit)
+    params.w = 90.0  # Longitude of periastron (degrees)
+    params.limb_dark = "quadratic"  # Limb darkening model
+    params.u = [0.4, 0.3]  # Limb darkening coefficients
+
+    return batman.TransitModel(params, time)
+
+
 def transit_fit(
     time: np.ndarray,
     flux: np.ndarray,
@@ -96,6 +169,7 @@ def transit_fit(
     rp_guess: float,
     inc_guess: float,
     plot_results: bool = True,
+    verbose: bool = True,
 ) -> Tuple[np.ndarray, np.ndarray, dict]:
     """
     Fit a transit model to photometric data using the batman package.
@@ -124,6 +198,8 @@ def transit_fit(
         Initial guess for orbital inclination in degrees
     plot_results : bool
         Whether to create diagnostic plots
+    verbose : bool
+        Whether to print the fit results
 
     Returns:
     --------
@@ -163,14 +239,32 @@ def transit_fit(
     # Define transit boundaries for baseline fitting
     # Select points outside the transit for baseline correction
     half_duration = duration_known / 2
-    starttime_idx = np.argmin(np.abs(time - (t0_guess - half_duration)))
-    endtime_idx = np.argmin(np.abs(time - (t0_guess + half_duration)))
+    in_transit = (time >= t0_guess - half_duration) & (time <= t0_guess + half_duration)
 
     # Fit quadratic baseline to out-of-transit data
-    baseline_time = np.concatenate((time[:starttime_idx], time[endtime_idx:]))
-    baseline_flux = np.concatenate((flux[:starttime_idx], flux[endtime_idx:]))
+    out_of_transit = ~in_transit
+    baseline_time = time[out_of_transit]
+    baseline_flux = flux[out_of_transit]
 
     baseline_model = fit_quadratic_baseline(baseline_time, baseline_flux)
+    # The baseline does not depend on the fit parameters, so evaluate it once
+    baseline_vec = baseline_model(time)
+
+    # Set up batman transit parameters for this fit
+    params = batman.TransitParams()
+    params.t0 = t0_guess  # Mid-transit time
+    params.per = period_known  # Orbital period
+    params.rp = rp_guess  # Planet radius / stellar radius
+    params.a = a_guess  # Semi-major axis / stellar radius
+    params.inc = inc_guess  # Inclination (degrees)
+    params.ecc = 0.0  # Eccentricity (circular orbit)
+    params.w = 90.0  # Longitude of periastron (degrees)
+    params.limb_dark = "quadratic"  # Limb darkening model
+    params.u = [u1_guess, u2_guess]  # Limb darkening coefficients
+
+    # Reuse a batman model built on this time grid; only the parameters change
+    # between fit iterations (and between fits of data with the same cadence)
+    transit = _get_transit_model(time.tobytes(), time.dtype.str)
 
     def transit_model(
         t: np.ndarray,
@@ -207,23 +301,20 @@ def transit_fit(
         np.ndarray
             Model flux values
         """
-        # Set up batman transit parameters
-        params = batman.TransitParams()
-        params.t0 = t0  # Mid-transit time
-        params.per = per  # Orbital period
-        params.rp = rp  # Planet radius / stellar radius
-        params.a = a  # Semi-major axis / stellar radius
-        params.inc = inc  # Inclination (degrees)
-        params.ecc = 0.0  # Eccentricity (circular orbit)
-        params.w = 90.0  # Longitude of periastron (degrees)
-        params.limb_dark = "quadratic"  # Limb darkening model
-        params.u = [u1, u2]  # Limb darkening coefficients
-
-        # Generate transit model
-        transit = batman.TransitModel(params, t)
-        transit_curve = transit.light_curve(params)
+        # Update batman transit parameters in one go (eccentricity, periastron
+        # and limb darkening law are fixed when the model is built)
+        params.__dict__.update(t0=t0, per=per, rp=rp, a=a, inc=inc, u=[u1, u2])
+
+        # Generate transit model with baseline correction, reusing the cached
+        # model and baseline on the fit time grid
+        if t is time:
+            # batman returns a fresh array, so scale it in place
+            transit_curve = transit.light_curve(params)
+            np.multiply(transit_curve, baseline_vec, out=transit_curve)
+            return transit_curve
 
         # Apply baseline correction
+        transit_curve = batman.TransitModel(params, t).light_curve(params)
         return transit_curve * baseline_model(t)
 
     # Define parameter bounds for fitting
@@ -234,15 +325,21 @@ def transit_fit(
     )
 
     try:
-        # Perform the fit
-        popt, pcov = curve_fit(
-            transit_model,
-            time,
-            flux,
-            p0=p0,
+        # Perform the fit, scaling parameters by the Jacobian column norms
+        fit = least_squares(
+            lambda p: transit_model(time, *p) - flux,
+            p0,
             bounds=bounds,
-            maxfev=5000,  # Increase max function evaluations
+            method="trf",
+            x_scale="jac",
+            max_nfev=5000,  # Increase max function evaluations
         )
+        if not fit.success:
+            raise RuntimeError(f"Optimal parameters not found: {fit.message}")
+        popt = fit.x
+
+        # Estimate the covariance matrix from the Jacobian
+        pcov = _covariance_from_jacobian(fit.jac, 2 * fit.cost, len(time) - len(popt))
 
         # Calculate parameter uncertainties
         perr = np.sqrt(np.diag(pcov))
@@ -251,41 +348,45 @@ def transit_fit(
         best_fit = transit_model(time, *popt)
         residuals = flux - best_fit
 
-        # Calculate fit statistics
-        rms_residuals = np.sqrt(np.mean(residuals**2))
+        # Calculate fit statistics (dot product avoids a squared temporary)
+        rms_residuals = math.sqrt(np.dot(residuals, residuals) / residuals.size)
 
         # Print results
-        print("=" * 60)
-        print("TRANSIT FIT RESULTS")
-        print("=" * 60)
-
-        print(f"\nRMS residuals: {rms_residuals:.6f}")
-        print(f"Number of data points: {len(time)}")
-
-        print(f"\nInitial parameter guesses:")
-        for name, val in zip(param_names, p0):
-            if "time" in name.lower():
-                print(f"  {name:>25}: {val:.6f} BJD")
-            elif "period" in name.lower():
-                print(f"  {name:>25}: {val:.6f} days")
-            elif "inclination" in name.lower():
-                print(f"  {name:>25}: {val:.2f}°")
-            else:
-                print(f"  {name:>25}: {val:.6f}")
-
-        print(f"\nBest-fit parameters:")
-        for name, val, err in zip(param_names, popt, perr):
-            if "time" in name.lower():
-                print(f"  {name:>25}: {val:.6f} ± {err:.6f} BJD")
-            elif "period" in name.lower():
-                print(f"  {name:>25}: {val:.6f} ± {err:.6f} days")
-            elif "inclination" in name.lower():
-                print(f"  {name:>25}: {val:.2f} ± {err:.2f}°")
-            else:
-                print(f"  {name:>25}: {val:.6f} ± {err:.6f}")
+        if verbose:
+            print("=" * 60)
+            print("TRANSIT FIT RESULTS")
+            print("=" * 60)
+
+            print(f"\nRMS residuals: {rms_residuals:.6f}")
+            print(f"Number of data points: {len(time)}")
+
+            print(f"\nInitial parameter guesses:")
+            for name, val in zip(param_names, p0):
+                if "time" in name.lower():
+                    print(f"  {name:>25}: {val:.6f} BJD")
+                elif "period" in name.lower():
+                    print(f"  {name:>25}: {val:.6f} days")
+                elif "inclination" in name.lower():
+                    print(f"  {name:>25}: {val:.2f}°")
+                else:
+                    print(f"  {name:>25}: {val:.6f}")
+
+            print(f"\nBest-fit parameters:")
+            for name, val, err in zip(param_names, popt, perr):
+                if "time" in name.lower():
+                    print(f"  {name:>25}: {val:.6f} ± {err:.6f} BJD")
+                elif "period" in name.lower():
+                    print(f"  {name:>25}: {val:.6f} ± {err:.6f} days")
+                elif "inclination" in name.lower():
+                    print(f"  {name:>25}: {val:.2f} ± {err:.2f}°")
+                else:
+                    print(f"  {name:>25}: {val:.6f} ± {err:.6f}")
 
         # Create diagnostic plots
         if plot_results:
+            # Imported here so non-plotting use doesn't initialise a backend
+            import matplotlib.pyplot as plt
+
             fig, (ax1, ax2) = plt.subplots(
                 2,
                 1,
@@ -351,3 +452,43 @@ def transit_fit(
         print(f"Fitting failed: {str(e)}")
         print("Try adjusting initial parameter guesses or bounds.")
         raise
+
+
+def transit_fit_batch(
+    time_list: List[np.ndarray],
+    flux_list: List[np.ndarray],
+    n_jobs: int = -1,
+    **kwargs,
+) -> List[Tuple[np.ndarray, np.ndarray, dict]]:
+    """
+    Fit several light curves in parallel with `transit_fit`.
+
+    Fits run in separate processes, limited to the CPUs available to the
+    container. Plotting and printing are disabled for each fit.
+
+    Parameters:
+    -----------
+    time_list : List[np.ndarray]
+        Time arrays (BJD), one per light curve
+    flux_list : List[np.ndarray]
+        Normalized flux arrays, one per light curve
+    n_jobs : int
+        Maximum number of parallel fits (-1 uses all available CPUs)
+    **kwargs
+        Remaining `transit_fit` arguments, shared by all fits
+
+    Returns:
+    --------
+    List[Tuple[np.ndarray, np.ndarray, dict]]
+        `transit_fit` output for each light curve, in input order
+    """
+    from joblib import Parallel, delayed
+
+    if len(time_list) != len(flux_list):
+        raise ValueError("Time and flux lists must have the same length")
+
+    kwargs.update(plot_results=False, verbose=False)
+    return Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(transit_fit)(time, flux, **kwargs)
+        for time, flux in zip(time_list, flux_list)
+    )